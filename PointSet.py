@@ -1,6 +1,34 @@
-from typing import List, Tuple
+from typing import Dict, List, Tuple
 from enum import Enum
+from concurrent.futures import Executor
 import numpy as np
+from _gini_numba import NUMBA_AVAILABLE, best_splits_real
+
+def _row_key(features) -> bytes:
+    """Hashable key of the features of a point, used to look the point up"""
+
+    # Adding 0 turns -0.0 into 0.0, both being equal as features
+    return (np.ascontiguousarray(features, dtype=np.float64) + 0.0).tobytes()
+
+def _fits_float32(values: np.ndarray) -> bool:
+    """Tell whether float64 values are all exactly representable as float32"""
+
+    return np.array_equal(values.astype(np.float32), values, equal_nan=True)
+
+def _as_features_array(features) -> np.ndarray:
+    """Convert features to a 2D array in Fortran order
+
+    The array is in float32 when this loses no precision, and in float64 otherwise.
+    A float32 array is used as is, without a copy.
+    """
+
+    if isinstance(features, np.ndarray) and features.dtype == np.float32:
+        return np.asfortranarray(features)
+
+    features = np.asarray(features, dtype=np.float64)
+    if _fits_float32(features):
+        return features.astype(np.float32, order='F')
+    return np.asfortranarray(features)
 
 class FeaturesTypes(Enum):
     """Enumerate possible features types"""
@@ -9,6 +37,98 @@ class FeaturesTypes(Enum):
     CLASSES=1
     REAL=2
 
+def _split_counts(left_mask: np.ndarray, labels: np.ndarray) -> Tuple[int, int]:
+    """Count, in a single pass, the points sent to the left node and those of them labelled True"""
+
+    # Each point is encoded as 2*label + side, side being 1 for the left node
+    codes = (labels.view(np.uint8) << 1) | left_mask.view(np.uint8)
+    n_false_right, n_false_left, n_true_right, n_true_left = np.bincount(codes, minlength=4)
+    return int(n_false_left + n_true_left), int(n_true_left)
+
+def _weighted_gini(n_left, n1, n: int, n_true: int):
+    """Gini split of a set of n points, n_true of which are labelled True, sending
+    n_left points (n1 of them labelled True) to the left node.
+
+    Works elementwise when `n_left` and `n1` are arrays.
+    """
+
+    n3 = n_left - n1
+    n2 = n_true - n1
+    n4 = (n - n_left) - n2
+
+    gini1 = 1-(n1/n_left)**2-(n3/n_left)**2
+    gini2 = 1-(n2/(n - n_left))**2-(n4/(n - n_left))**2
+
+    return (n_left*gini1+(n - n_left)*gini2)/n
+
+def _best_split_on_feature(col: np.ndarray, feature_type: FeaturesTypes, labels: np.ndarray, n_true: int,
+                           min_split_points: int) -> Tuple[float, float]:
+    """Find the best split of a set of points along one feature
+
+    Every candidate split of the feature is scored at once. For categorical and real
+    features, the points are sorted along the feature so that the label counts of
+    each candidate are read from a cumulative sum of the sorted labels.
+
+    Parameters
+    ----------
+    col : np.array[float]
+        The values of the feature for each point of the set
+    feature_type : FeaturesTypes
+        The type of the feature
+    labels : np.array[bool]
+        The labels of the points of the set
+    n_true : int
+        Number of points labelled True in the set
+    min_split_points : int
+        Lower bound of the number of points in the nodes (threshold).
+
+    Returns
+    -------
+    Tuple[float,float]
+        The split value of the best split (as PointSet.get_best_threshold) and its
+        Gini split, or (None, None) if no split satisfies the stopping rule.
+    """
+
+    n = len(labels)
+
+    if feature_type == FeaturesTypes.BOOLEAN :
+        n_left, n1 = _split_counts(col.astype(bool), labels)
+        n_left, n1 = np.array([n_left]), np.array([n1])
+    else :
+        order = np.argsort(col, kind='stable')
+        col = col[order]
+        cum_true = np.cumsum(labels[order], dtype=np.int64)
+
+        # Positions in the sorted points where the value of the feature changes
+        bounds = np.flatnonzero(col[1:] != col[:-1]) + 1
+
+        if feature_type == FeaturesTypes.REAL :
+            # The points [0, i) go to the left node and the points [i, n) to the right one
+            n_left = bounds
+            n1 = cum_true[bounds - 1]
+        elif feature_type == FeaturesTypes.CLASSES :
+            # The points of one category, [start, end), go to the left node
+            starts = np.concatenate(([0], bounds))
+            ends = np.concatenate((bounds, [n]))
+            n_left = ends - starts
+            n1 = cum_true[ends - 1] - np.where(starts > 0, cum_true[starts - 1], 0)
+
+    valid = np.flatnonzero((n_left > 0) & (n - n_left > 0) & (n_left >= min_split_points) & (n - n_left >= min_split_points))
+    if len(valid) == 0:
+        return None, None
+
+    gini_splits = _weighted_gini(n_left[valid], n1[valid], n, n_true)
+    best = valid[int(np.argmin(gini_splits))]
+
+    if feature_type == FeaturesTypes.BOOLEAN :
+        value = None
+    elif feature_type == FeaturesTypes.REAL :
+        # Computed in float64, the midpoint of two float32 values may not fit in float32
+        value = (np.float64(col[bounds[best] - 1]) + np.float64(col[bounds[best]])) / 2
+    elif feature_type == FeaturesTypes.CLASSES :
+        value = col[starts[best]]
+    return value, float(np.min(gini_splits))
+
 class PointSet:
     """A class representing set of training points.
 
@@ -19,9 +139,15 @@ class PointSet:
             features of each point
         features : np.array[float]
             2D array containing the features of the points. Each line
-            corresponds to a point, each column to a feature.
+            corresponds to a point, each column to a feature. It is
+            stored column by column (Fortran order), so that the values
+            of a feature are contiguous in memory, and in float32 when
+            all the values fit without loss of precision (float64 otherwise). It is a view on the
+            first rows of a larger buffer, which leaves room for the points
+            added by `append`.
         labels : np.array[bool]
-            1D array containing the labels of the points.
+            1D array containing the labels of the points (a view on a
+            buffer, as `features`).
        split_feature : int
             along which feature the points have been split
         split_value: float
@@ -40,21 +166,182 @@ class PointSet:
             list represents a point, each of its elements is a feature
             of the point. All the sublists should have the same size as
             the `types` parameter, and the list itself should have the
-            same size as the `labels` parameter.
+            same size as the `labels` parameter. A 2D np.float32 array
+            in Fortran order, or a float64 one whose values do not fit
+            in float32, is used as is, without a copy.
         labels : List[bool]
-            The labels of the points.
+            The labels of the points. A np.bool_ array is used as is,
+            without a copy.
         types : List[FeaturesTypes]
             The types of the features of the points.
         """
 
+        # Convert with an explicit dtype rather than letting NumPy infer it from the elements
+        labels = np.asarray(labels, dtype=np.bool_)
+        features = _as_features_array(features)
+        if features.shape != (len(labels), len(types)):
+            if len(labels) != 0:
+                raise ValueError(f"The features should have the shape {(len(labels), len(types))}, not {features.shape}!")
+            # An empty list of points gives a 1D array
+            features = features.reshape(0, len(types), order='F')
+        self._init_points(features, labels, types)
+
+    def _init_points(self, features: np.ndarray, labels: np.ndarray, types: List[FeaturesTypes]):
         self.types = types
-        self.features = np.array(features)
-        self.labels = np.array(labels)
+        self._labels = labels
+        self._features = features
+        self._size = len(self._labels)
+        self._row_index = None
         self.split = None
         self.threshold = None
         self.split_feature = None
         self.category_id = None
     
+    def _take(self, indices: np.ndarray) -> 'PointSet':
+        """Build a new PointSet holding a copy of the points at `indices`
+
+        The features keep the dtype of the set, so they are gathered straight into
+        Fortran order without being converted again.
+        """
+
+        features = np.empty((len(indices), len(self.types)), dtype=self._features.dtype, order='F')
+        # Column by column, as the values of a feature are contiguous in both arrays
+        for p in range(len(self.types)):
+            features[:, p] = self._features[indices, p]
+
+        subset = PointSet.__new__(PointSet)
+        subset._init_points(features, self.labels[indices], self.types)
+        return subset
+
+    @property
+    def features(self) -> np.ndarray:
+        """The features of the points of the set"""
+
+        return self._features[:self._size]
+
+    @property
+    def labels(self) -> np.ndarray:
+        """The labels of the points of the set"""
+
+        return self._labels[:self._size]
+
+    def append(self, features: List[float], label: bool) -> int:
+        """Add a point at the end of the set
+
+        The points are stored in buffers whose capacity is doubled when they are
+        full, so that adding a point takes amortized constant time.
+
+        Parameters
+        ----------
+        features : List[float]
+            The features of the point
+        label : bool
+            The label of the point
+
+        Returns
+        -------
+        int
+            The index of the new point in the set
+        """
+
+        # Switch to float64 if the point does not fit in float32
+        features = np.asarray(features, dtype=np.float64)
+        if self._features.dtype == np.float32 and not _fits_float32(features):
+            self._features = self._features.astype(np.float64, order='F')
+
+        if self._size == len(self._labels):
+            capacity = max(2 * self._size, 1)
+            new_features = np.empty((capacity, self._features.shape[1]), dtype=self._features.dtype, order='F')
+            new_features[:self._size] = self.features
+            new_labels = np.empty(capacity, dtype=bool)
+            new_labels[:self._size] = self.labels
+            self._features, self._labels = new_features, new_labels
+
+        self._features[self._size] = features
+        self._labels[self._size] = label
+        if self._row_index is not None:
+            self._row_index.setdefault(_row_key(self._features[self._size]), []).append(self._size)
+        self._size += 1
+        return self._size - 1
+
+    def remove(self, index: int) -> int:
+        """Remove a point from the set by moving the last point in its place
+
+        Parameters
+        ----------
+        index : int
+            The index of the point to remove
+
+        Returns
+        -------
+        int
+            The former index of the point moved to `index`. It is equal to
+            `index` when the removed point was the last one.
+        """
+
+        # Moving a point breaks the insertion order of the rows, on which `find` relies
+        if self._row_index is None:
+            self._index_rows()
+
+        last = self._size - 1
+        key = _row_key(self._features[index])
+        self._row_index[key].remove(index)
+        if not self._row_index[key]:
+            del self._row_index[key]
+        if last != index:
+            # Renamed in place, so that the list keeps its insertion order
+            moved = self._row_index[_row_key(self._features[last])]
+            moved[moved.index(last)] = index
+
+        self._features[index] = self._features[last]
+        self._labels[index] = self._labels[last]
+        self._size -= 1
+        return last
+
+    def find(self, features: List[float]) -> int:
+        """Look up a point of the set from its features
+
+        The first call indexes the points of the set in a dictionary, which is then
+        kept up to date by `append` and `remove`, so that a lookup does not depend
+        on the number of points.
+
+        Parameters
+        ----------
+        features : List[float]
+            The features of the point
+
+        Returns
+        -------
+        int
+            The index of the oldest point of the set having these features, or None
+            if there is no such point.
+        """
+
+        if self._row_index is None:
+            self._index_rows()
+
+        # The indices of a key are kept in insertion order: return the oldest point
+        indices = self._row_index.get(_row_key(features))
+        return indices[0] if indices else None
+
+    def _index_rows(self):
+        """Build the dictionary used by `find`, while the rows are still in insertion order"""
+
+        self._row_index = {}
+        for i in range(self._size):
+            self._row_index.setdefault(_row_key(self._features[i]), []).append(i)
+
+    def count_true(self) -> int:
+        """Count the points labelled True
+
+        Returns
+        -------
+        int
+            The number of points labelled True
+        """
+
+        return int(np.count_nonzero(self.labels))
+
     def get_gini(self) -> float:
         """Computes the Gini score of the set of points
 
@@ -64,16 +351,11 @@ class PointSet:
             The Gini score of the set of points
         """
 
-        n1,n2=0,0
-        n=len(self.labels) 
-        for label in self.labels :
-            if label :
-                n1+=1
-            else :
-                n2+=1
-        return 1-(n1/n)**2-(n2/n)**2
+        n = self.labels.size
+        n1 = self.count_true()
+        return 1.0-(n1/n)**2-((n-n1)/n)**2
 
-    def gini_split(self, p: int, value: float = None, min_split_points: int = 1) -> float:
+    def gini_split(self, p: int, value: float = None, min_split_points: int = 1, n_true: int = None) -> float:
         """Compute the Gini split of the set of points based on the given value with a stopping rule
 
         Parameters
@@ -85,6 +367,9 @@ class PointSet:
         min_split_points : int
             Lower bound of the number of points in the nodes (threshold). Each node in the
             tree (including the leaves) is associated with at least min_split_points points.
+        n_true : int
+            Number of points labelled True in the set. Computed if not provided, callers
+            evaluating several splits of the same set should compute it once.
 
         Returns
         -------
@@ -92,34 +377,55 @@ class PointSet:
             The Gini split of the set of points
         """
 
-        features1, features2 = [], []
-        n=len(self.features)
-
-        for i in range (n) :
-            if self.types[p] == FeaturesTypes.BOOLEAN :
-                if self.features[i][p] : features1+=[i]
-                else : features2+=[i]
-            elif self.types[p] == FeaturesTypes.CLASSES :
-                if self.features[i][p] == value : features1+=[i]
-                else : features2+=[i]
-            elif self.types[p] == FeaturesTypes.REAL :
-                if self.features[i][p] < value : features1+=[i]
-                else : features2+=[i]
-
-        n1 = sum(1 for k in features1 if self.labels[k])
-        n2 = sum(1 for k in features2 if self.labels[k])
-        n3 = sum(1 for k in features1 if not self.labels[k])
-        n4 = sum(1 for k in features2 if not self.labels[k])
-
-        if n1+n3==0 or n2+n4==0 or n1+n3<min_split_points or n2+n4<min_split_points : 
-            return None
+        n = len(self.labels)
+        if n_true is None:
+            n_true = self.count_true()
+
+        # Boolean mask of the points falling on the "left" side of the split
+        col = self.features[:, p]
+        if self.types[p] == FeaturesTypes.BOOLEAN :
+            left_mask = col.astype(bool)
+        elif self.types[p] == FeaturesTypes.CLASSES :
+            left_mask = col == value
+        elif self.types[p] == FeaturesTypes.REAL :
+            left_mask = col < value
 
-        gini1 = 1-(n1/(n1+n3))**2-(n3/(n1+n3))**2
-        gini2 = 1-(n2/(n2+n4))**2-(n4/(n2+n4))**2
+        n_left, n1 = _split_counts(left_mask, self.labels)
 
-        return ((n1+n3)*gini1+(n2+n4)*gini2)/n
+        if n_left==0 or n-n_left==0 or n_left<min_split_points or n-n_left<min_split_points : 
+            return None
+
+        return _weighted_gini(n_left, n1, n, n_true)
     
-    def get_best_gain(self, min_split_points: int = 1) -> Tuple[int, float]:
+    def _search_feature(self, p: int, min_split_points: int, n_true: int) -> Tuple[float, float]:
+        """Run _best_split_on_feature along feature p of the set"""
+
+        return _best_split_on_feature(self.features[:, p], self.types[p], self.labels, n_true, min_split_points)
+
+    def _best_real_splits(self, features_ids: List[int], min_split_points: int, n_true: int) -> Dict[int, Tuple[float, float]]:
+        """Find the best split along each of the given real features
+
+        Uses the Numba kernels, all the features being processed in parallel, when
+        Numba is available, and _search_feature otherwise.
+
+        Returns
+        -------
+        Dict[int,Tuple[float,float]]
+            For each feature index, the best threshold and the associated Gini split,
+            or (None, None) if no threshold satisfies the stopping rule.
+        """
+
+        if not NUMBA_AVAILABLE or len(features_ids) == 0:
+            return {p: self._search_feature(p, min_split_points, n_true) for p in features_ids}
+
+        orders = [np.argsort(self.features[:, p], kind='stable') for p in features_ids]
+        cols_sorted = np.asfortranarray(np.column_stack([self.features[order, p] for order, p in zip(orders, features_ids)]))
+        labs_sorted = np.asfortranarray(np.column_stack([self.labels[order] for order in orders]))
+        thresholds, ginis = best_splits_real(cols_sorted, labs_sorted, n_true, min_split_points)
+
+        return {p: (thresholds[j], ginis[j]) if ginis[j] >= 0 else (None, None) for j, p in enumerate(features_ids)}
+
+    def get_best_gain(self, min_split_points: int = 1, executor: Executor = None) -> Tuple[int, float]:
         """Compute the best Gini Gain of the set of points with a stopping criteria 
 
         Parameters
@@ -127,6 +433,10 @@ class PointSet:
         min_split_points : int
             Lower bound of the number of points in the nodes (threshold). Each node in
             the tree (including the leaves) is associated with at least min_split_points points.
+        executor : Executor
+            Threads searching the best split of the features in parallel, or None to
+            search them one after the other. The NumPy code releases the GIL, so the
+            features are actually processed concurrently.
 
         Returns
         -------
@@ -138,24 +448,46 @@ class PointSet:
         max = None,0.0
         n_features=len(self.types)
 
-        for p in range(n_features):
-            values = np.unique(self.features[:,p])
+        # Both nodes need at least min_split_points points (and at least one)
+        n = len(self.labels)
+        if n < 2 or n < 2 * min_split_points:
+            return None, None
+
+        # The gain of a split is at most the Gini score of the set, reached when both
+        # nodes are pure: a pure set cannot be improved by any split
+        n_true = self.count_true()
+        parent_gini = self.get_gini()
+        if parent_gini == 0.0:
+            return None, None
+
+        # Real features all go through the parallel Numba kernel when it is available
+        real_features = [p for p in range(n_features) if self.types[p] == FeaturesTypes.REAL] if NUMBA_AVAILABLE else []
+        real_splits = self._best_real_splits(real_features, min_split_points, n_true)
+        other_features = [p for p in range(n_features) if p not in real_splits]
+
+        def search(p):
+            return self._search_feature(p, min_split_points, n_true)
 
-            if self.types[p] == FeaturesTypes.BOOLEAN :
-                split_values = [None]
-            elif self.types[p] == FeaturesTypes.REAL :
-                split_values = [(sorted(values)[i] + sorted(values)[i + 1]) / 2 for i in range(len(sorted(values)) - 1)]
-            elif self.types[p] == FeaturesTypes.CLASSES : 
-                split_values = values
+        parallel = executor is not None and len(other_features) > 1
+        # Evaluated lazily when sequential, so that the loop below can stop early
+        other_splits = executor.map(search, other_features) if parallel else map(search, other_features)
+        try:
+            for p in range(n_features):
+                # Once a split reaches the maximal gain, no other split can beat it
+                if max[1] >= parent_gini:
+                    break
 
-            for v in split_values:
-                gini_split = self.gini_split(p, v, min_split_points)
+                v, gini_split = real_splits[p] if p in real_splits else next(other_splits)
                 if gini_split is not None:
-                    gain = self.get_gini() - gini_split
+                    gain = parent_gini - gini_split
                     if gain > max[1]:
                         max = p,gain
                         self.split_value = v
                         self.split_feature = p
+        finally:
+            # Closing the results of the executor cancels the searches not started yet
+            if parallel:
+                other_splits.close()
 
         if max[1] == 0.0:
             return None, None
@@ -1,14 +1,25 @@
 from typing import List
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from PointSet import PointSet, FeaturesTypes
+from _gini_numba import NUMBA_AVAILABLE, walk_tree_batch
+
+# Layout of the flattened nodes of a tree. A split node sends a point to `left` if its
+# feature `feat` is lower than `thr` (kind 0, continuous split) or equal to `thr`
+# (kind 1, categorical or boolean split), and to `right` otherwise. Leaves have
+# `left` and `right` set to -1 and hold the label given to the points reaching them.
+_NODE_DTYPE = np.dtype([('feat', 'i4'), ('thr', 'f8'), ('kind', 'i1'), ('left', 'i4'), ('right', 'i4'), ('leaf', '?')])
 
 class Tree:
     """A decision Tree
 
     Attributes
     ----------
-        points : PointSet
-            The training points of the tree
+        root_points : PointSet
+            The training points of the whole tree. It is shared by all
+            the nodes of the tree, which only store indices into it.
+        indices : np.array[int]
+            Indices in `root_points` of the training points of the node
         h : int
             The maximum height of the tree
         counter : int
@@ -29,6 +40,10 @@ class Tree:
             The regularization parameter. It is used to penalize the
             complexity of the tree. The higher the value of beta, the
             simpler the tree will.
+        executor : ThreadPoolExecutor
+            The threads used to search the best split of a node. It is
+            shared by all the nodes of the tree, and set to None when
+            the split is searched by a single thread.
     """
 
     def __init__(self,
@@ -37,7 +52,8 @@ class Tree:
                  types: List[FeaturesTypes],
                  h: int = 1,
                  min_split_points: int = 1,
-                 beta : float = 0):
+                 beta : float = 0,
+                 n_jobs: int = 1):
         """
         Parameters
         ----------
@@ -57,18 +73,47 @@ class Tree:
                 The minimum number of points required to split a node.
             beta : float
                 The regularization parameter.
+            n_jobs : int
+                The number of threads used to search the best split of a node.
         """
 
+        # The shared PointSet is modified in place by add/del, so it gets its own copy of the points
+        root_points = PointSet(np.array(features, dtype=np.float64, order='F'), np.array(labels, dtype=np.bool_), types)
+        # The threads are created once for the tree, and reused by every search of a split
+        executor = ThreadPoolExecutor(max_workers=n_jobs) if n_jobs > 1 else None
+        self._init_node(root_points, np.arange(len(root_points.labels)), h, min_split_points, beta, executor)
+
+    @classmethod
+    def _from_indices(cls, root_points: PointSet, indices: np.ndarray, h: int, min_split_points: int, beta: float,
+                      executor: ThreadPoolExecutor) -> 'Tree':
+        """Build a subtree over the points of `root_points` given by `indices`"""
+
+        tree = cls.__new__(cls)
+        tree._init_node(root_points, indices, h, min_split_points, beta, executor)
+        return tree
+
+    def _init_node(self, root_points: PointSet, indices: np.ndarray, h: int, min_split_points: int, beta: float,
+                   executor: ThreadPoolExecutor):
         self.h = h
         self.feature_id = None
         self.feature_threshold = None
         self.feature_split = None
-        self.points = PointSet(features, labels, types)
+        self._split_left_set = None
+        self._split_left_arr = None
+        self.root_points = root_points
+        self.indices = indices
         self.min_split_points = min_split_points
         self.counter = 0 
         self.beta = beta
+        self.executor = executor
+        self._label = None
         self.build_tree()
 
+    def _gather_points(self) -> PointSet:
+        """Build a new PointSet holding a copy of the training points of the node"""
+
+        return self.root_points._take(self.indices)
+
     def build_tree(self):
         """Recursively builds the decision tree by splitting points based on the best Gini gain."""
 
@@ -76,8 +121,16 @@ class Tree:
         if self.h == 0:
             return
         
+        # Forget the previous split if the node is being rebuilt
+        self.feature_id = None
+        self.feature_threshold = None
+        self.feature_split = None
+        self._split_left_set = None
+        self._split_left_arr = None
+
         # Find the best feature and gain for splitting
-        feature_id, best_gain = self.points.get_best_gain(min_split_points=self.min_split_points)
+        points = self._gather_points()
+        feature_id, best_gain = points.get_best_gain(min_split_points=self.min_split_points, executor=self.executor)
 
         # If no valid split is found, stop further splitting
         if feature_id is None:
@@ -85,45 +138,42 @@ class Tree:
             return
 
         # Determine if the feature is continuous or categorical
-        is_continous = (self.points.types[feature_id] == FeaturesTypes.REAL)
-        threshold = self.points.get_best_threshold()
+        is_continous = (points.types[feature_id] == FeaturesTypes.REAL)
+        threshold = points.get_best_threshold()
+
+        col = points.features[:, feature_id]
 
         # Handle categorical or continuous splitting
         if not is_continous:
             if threshold is not None:
-                split = ([threshold], list(set([f for f in self.points.features[:, feature_id] if f != threshold])))
+                split = ([threshold], np.unique(col[col != threshold]).tolist())
             else:
                 split = ([0], [1])
             self.feature_split = split
+            # Values sent to the left child, as a set for single points and as an array for np.isin
+            self._split_left_set = frozenset(split[0])
+            self._split_left_arr = np.asarray(split[0])
         else:
             self.feature_threshold = threshold
 
         self.feature_id = feature_id
 
-        # Prepare lists to store the left and right splits
-        left_features, left_labels = [], []
-        right_features, right_labels = []
-
         # Split the points into left and right subsets based on the threshold or split
-        for i, point in enumerate(self.points.features):
-            if (is_continous and point[self.feature_id] < threshold) or (not is_continous and point[self.feature_id] in split[0]):
-                left_features.append(point)
-                left_labels.append(self.points.labels[i])
-            else:
-                right_features.append(point)
-                right_labels.append(self.points.labels[i])
+        if is_continous:
+            mask = col < threshold
+        else:
+            mask = np.isin(col, self._split_left_arr)
+
+        left_indices, right_indices = self.indices[mask], self.indices[~mask]
 
         # If either left or right has too few points, stop further splitting
-        if len(left_features) < self.min_split_points or len(right_features) < self.min_split_points:
+        if len(left_indices) < self.min_split_points or len(right_indices) < self.min_split_points:
             self.h = 0
             return
 
-        # Recursively build the left and right subtrees
-        self.left = Tree(left_features, left_labels, self.points.types, self.h - 1, self.min_split_points, self.beta)
-        self.left.build_tree()
-
-        self.right = Tree(right_features, right_labels, self.points.types, self.h - 1, self.min_split_points, self.beta)
-        self.right.build_tree()
+        # Recursively build the left and right subtrees (the constructor builds them)
+        self.left = Tree._from_indices(self.root_points, left_indices, self.h - 1, self.min_split_points, self.beta, self.executor)
+        self.right = Tree._from_indices(self.root_points, right_indices, self.h - 1, self.min_split_points, self.beta, self.executor)
 
     def decide(self, features: List[float]) -> bool:
         """Give the guessed label of the tree to an unlabeled point
@@ -138,104 +188,178 @@ class Tree:
         bool
             The label of the unlabeled point, guessed by the Tree.
         """
-        
-        # If the node is a leaf, return the majority label in this node
-        if self.h == 0:
-            # Determine the majority class (True or False) in the leaf
-            return np.count_nonzero(self.points.labels) >= len(self.points.labels) / 2
 
-        # Handle continuous and categorical splits
-        if self.feature_split is None:  # Continuous feature split
-            if features[self.feature_id] < self.feature_threshold:
-                return self.left.decide(features)
+        # Walk down the nodes until reaching a leaf
+        node = self
+        while node.h != 0:
+            node = node._child(features)
+        return node._majority_label()
+
+    def decide_batch(self, features: np.ndarray) -> np.ndarray:
+        """Give the guessed labels of the tree to a batch of unlabeled points
+
+        Parameters
+        ----------
+        features : np.array[float]
+            2D array containing the features of the unlabeled points,
+            one point per line.
+
+        Returns
+        -------
+        np.array[bool]
+            The labels of the unlabeled points, guessed by the Tree.
+        """
+
+        nodes = self._freeze()
+        features = np.asarray(features, dtype=np.float64)
+
+        if NUMBA_AVAILABLE:
+            return walk_tree_batch(nodes['feat'], nodes['thr'], nodes['kind'], nodes['left'], nodes['right'], nodes['leaf'], features)
+
+        # Move the points not in a leaf yet one level down at a time, until they all reach one
+        idx = np.zeros(len(features), dtype=np.int32)
+        rows = np.arange(len(features))
+        while True:
+            rows = rows[nodes['left'][idx[rows]] != -1]
+            if len(rows) == 0:
+                return nodes['leaf'][idx]
+            node = nodes[idx[rows]]
+            values = features[rows, node['feat']]
+            go_left = np.where(node['kind'] == 0, values < node['thr'], values == node['thr'])
+            idx[rows] = np.where(go_left, node['left'], node['right'])
+
+    def _freeze(self) -> np.ndarray:
+        """Return the tree flattened into an array of nodes, the root being the first one"""
+
+        nodes = []
+
+        def flatten(tree: 'Tree') -> int:
+            position = len(nodes)
+            nodes.append(None)
+            if tree.h == 0:
+                nodes[position] = (0, 0.0, 0, -1, -1, tree._majority_label())
             else:
-                return self.right.decide(features)
+                if tree.feature_split is None:  # Continuous feature split
+                    kind, threshold = 0, tree.feature_threshold
+                else:  # Categorical feature split, on a single value
+                    kind, threshold = 1, tree.feature_split[0][0]
+                left = flatten(tree.left)
+                right = flatten(tree.right)
+                nodes[position] = (tree.feature_id, threshold, kind, left, right, False)
+            return position
+
+        flatten(self)
+        return np.array(nodes, dtype=_NODE_DTYPE)
+
+    def _majority_label(self) -> bool:
+        """Return the majority label (True or False) among the points of the node"""
+
+        # Computed once, until a point is added to or removed from the node
+        if self._label is None:
+            labels = self.root_points.labels[self.indices]
+            self._label = np.count_nonzero(labels) >= len(labels) / 2
+        return self._label
+
+    def _child(self, features: List[float]) -> 'Tree':
+        """Return the child of the node into which the given point falls"""
+
+        if self.feature_split is None:  # Continuous feature split
+            is_left = features[self.feature_id] < self.feature_threshold
         else:  # Categorical feature split
-            if features[self.feature_id] in self.feature_split[0]:
-                return self.left.decide(features)
-            else:
-                return self.right.decide(features)
+            is_left = features[self.feature_id] in self._split_left_set
+        return self.left if is_left else self.right
 
     def add_training_point(self, features: List[float], label: bool):
         """Add a new training point to the tree, potentially rebuilding it if necessary."""
-        
+
+        # Store the point once in the shared PointSet, the nodes only keep its index
+        index = self.root_points.append(features, label)
+        features = self.root_points.features[index]
+
+        # Walk down the nodes receiving the point
+        node = self
+        while node is not None:
+            node = node._add_index(index, features)
+
+    def _add_index(self, index: int, features: List[float]) -> 'Tree':
+        """Add the point of `root_points` at `index` to the node.
+
+        Returns the child into which the point falls, or None if the point goes no further.
+        """
+
         # Increment the counter of points added
         self.counter += 1
-
-        # Add the new point to the PointSet only if the tree is not a leaf
-        if self.h > 0:
-            new_features = np.vstack([self.points.features, features])
-            new_labels = np.append(self.points.labels, label)
-            self.points = PointSet(new_features, new_labels, self.points.types)
+        self._label = None
+        self.indices = np.append(self.indices, index)
 
         # Determine if the tree needs to be rebuilt based on the regularization parameter beta
-        if self.counter >= self.beta * len(self.points.features):
+        if self.counter >= self.beta * len(self.indices):
             self.counter = 0
             
             # Rebuild the tree
             self.build_tree()
-            return
+            return None
 
         # If the current node is a leaf, do nothing
         if self.h == 0:
-            return
+            return None
 
-        # Recursively add the training point to the correct subtree
-        if self.feature_split is None:  # Continuous feature split
-            if features[self.feature_id] < self.feature_threshold:
-                self.left.add_training_point(features, label)
-            else:
-                self.right.add_training_point(features, label)
-        else:  # Categorical feature split
-            if features[self.feature_id] in self.feature_split[0]:
-                self.left.add_training_point(features, label)
-            else:
-                self.right.add_training_point(features, label)    
+        # Continue with the correct subtree
+        return self._child(features)
 
     def del_training_point(self, features: List[float], label: bool):
         """Delete a training point from the tree and rebuild the tree if necessary."""
-        
-        # Increment the counter of points removed
-        self.counter += 1
 
-        # Find the index of the point to remove
-        if self.h > 0:
-            # Convert features to a numpy array for comparison
-            features_array = np.array(features)
-            
-            # Use a boolean mask to find the point matching the features
-            mask = np.all(self.points.features == features_array, axis=1)
-            indices_to_remove = np.where(mask)[0]
-            
-            # If no matching point is found, exit the function
-            if len(indices_to_remove) == 0:
+        # Find the index of the point to remove among the points of the tree
+        features_array = np.asarray(features, dtype=np.float64)
+        index = self.root_points.find(features_array)
+
+        # If no matching point is found, exit the function. The search still counts as
+        # an event of the root, which only rebuilds on the next events.
+        if index is None:
+            self.counter += 1
+            return
+
+        node = self
+        while node is not None:
+            node = node._del_index(index, features_array)
+
+        # Free the row of the point: the last point of root_points is moved in its place
+        moved = self.root_points.remove(index)
+        if moved != index:
+            self._rename_index(moved, index)
+
+    def _rename_index(self, old_index: int, new_index: int):
+        """Replace `old_index` by `new_index` in the nodes holding the point now stored at `new_index`."""
+
+        features = self.root_points.features[new_index]
+        node = self
+        while True:
+            node.indices[node.indices == old_index] = new_index
+            if node.h == 0:
                 return
+            node = node._child(features)
+
+    def _del_index(self, index: int, features: List[float]) -> 'Tree':
+        """Remove the point of `root_points` at `index` from the node.
 
-            # Remove the point and its label using numpy indexing
-            new_features = np.delete(self.points.features, indices_to_remove[0], axis=0)
-            new_labels = np.delete(self.points.labels, indices_to_remove[0], axis=0)
+        Returns the child into which the point falls, or None if the point goes no further.
+        """
 
-            # Update the PointSet with the remaining points
-            self.points = PointSet(new_features, new_labels, self.points.types)
+        # Increment the counter of points removed
+        self.counter += 1
+        self._label = None
+        self.indices = self.indices[self.indices != index]
 
         # Rebuild the tree if necessary based on the beta regularization parameter
-        if self.counter >= self.beta * len(self.points.features):
+        if self.counter >= self.beta * len(self.indices):
             self.counter = 0
             self.build_tree()
-            return
+            return None
 
         # If the current node is a leaf, stop the process
         if self.h == 0:
-            return
+            return None
 
-        # Recursively delete the point in the correct subtree
-        if self.feature_split is None:  # Continuous feature split
-            if features[self.feature_id] < self.feature_threshold:
-                self.left.del_training_point(features, label)
-            else:
-                self.right.del_training_point(features, label)
-        else:  # Categorical feature split
-            if features[self.feature_id] in self.feature_split[0]:
-                self.left.del_training_point(features, label)
-            else:
-                self.right.del_training_point(features, label)
\ No newline at end of file
+        # Continue with the correct subtree
+        return self._child(features)
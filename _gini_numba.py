@@ -0,0 +1,147 @@
+"""Numba kernels used by PointSet to search the best split along real features,
+and by Tree to walk its flattened nodes.
+
+Numba is an optional dependency. When it cannot be imported, NUMBA_AVAILABLE is
+set to False, the kernels below stay plain Python functions and PointSet and Tree
+use their NumPy implementations for the heavy work instead.
+"""
+
+import numpy as np
+
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        """Replacement of numba.njit leaving the function untouched"""
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda function: function
+
+    prange = range
+
+
+@njit(cache=True)
+def best_split_real(col_sorted, lab_sorted, n_true, min_split_points):
+    """Find the best threshold along a sorted real feature in a single sweep
+
+    Parameters
+    ----------
+    col_sorted : np.array[float]
+        Values of the feature, sorted in increasing order.
+    lab_sorted : np.array[bool]
+        Labels of the points, in the same order as `col_sorted`.
+    n_true : int
+        Number of points labelled True.
+    min_split_points : int
+        Lower bound of the number of points in each of the two nodes.
+
+    Returns
+    -------
+    Tuple[float,float]
+        The best threshold and the associated Gini split. The Gini split is
+        set to -1 if no threshold satisfies the stopping rule.
+    """
+
+    n = col_sorted.shape[0]
+    best_threshold = 0.0
+    best_gini = -1.0
+    n1 = np.int64(0)
+
+    for i in range(1, n):
+        # Points [0, i) go to the left node, points [i, n) to the right one
+        if lab_sorted[i - 1]:
+            n1 += 1
+        if col_sorted[i] == col_sorted[i - 1] or i < min_split_points or n - i < min_split_points:
+            continue
+
+        n3 = i - n1
+        n2 = n_true - n1
+        n4 = (n - i) - n2
+        gini1 = 1.0 - (n1 / i) ** 2 - (n3 / i) ** 2
+        gini2 = 1.0 - (n2 / (n - i)) ** 2 - (n4 / (n - i)) ** 2
+        gini = (i * gini1 + (n - i) * gini2) / n
+
+        if best_gini < 0.0 or gini < best_gini:
+            best_gini = gini
+            best_threshold = (np.float64(col_sorted[i - 1]) + np.float64(col_sorted[i])) / 2
+
+    return best_threshold, best_gini
+
+
+@njit(cache=True, parallel=True)
+def best_splits_real(cols_sorted, labs_sorted, n_true, min_split_points):
+    """Run best_split_real on each column of a 2D array, in parallel
+
+    Parameters
+    ----------
+    cols_sorted : np.array[float]
+        2D array, each column holds the sorted values of one real feature.
+    labs_sorted : np.array[bool]
+        2D array, each column holds the labels sorted as the matching column
+        of `cols_sorted`.
+    n_true : int
+        Number of points labelled True.
+    min_split_points : int
+        Lower bound of the number of points in each of the two nodes.
+
+    Returns
+    -------
+    Tuple[np.array[float],np.array[float]]
+        The best threshold and the associated Gini split of each column.
+    """
+
+    n_columns = cols_sorted.shape[1]
+    thresholds = np.empty(n_columns)
+    ginis = np.empty(n_columns)
+
+    for j in prange(n_columns):
+        thresholds[j], ginis[j] = best_split_real(cols_sorted[:, j], labs_sorted[:, j], n_true, min_split_points)
+
+    return thresholds, ginis
+
+
+@njit(cache=True)
+def walk_tree(feat, thr, kind, left, right, leaf, x):
+    """Give the label of a point by walking the flattened nodes of a Tree
+
+    Parameters
+    ----------
+    feat, thr, kind, left, right, leaf : np.array
+        The fields of the flattened nodes (see Tree._freeze).
+    x : np.array[float]
+        The features of the point.
+
+    Returns
+    -------
+    bool
+        The label of the leaf reached by the point.
+    """
+
+    idx = 0
+    while left[idx] != -1:
+        value = x[feat[idx]]
+        if kind[idx] == 0:
+            go_left = value < thr[idx]
+        else:
+            go_left = value == thr[idx]
+        idx = left[idx] if go_left else right[idx]
+    return leaf[idx]
+
+
+@njit(cache=True, parallel=True)
+def walk_tree_batch(feat, thr, kind, left, right, leaf, X):
+    """Run walk_tree on each line of a 2D array of points, in parallel
+
+    Returns
+    -------
+    np.array[bool]
+        The label of the leaf reached by each point.
+    """
+
+    results = np.empty(X.shape[0], dtype=np.bool_)
+    for i in prange(X.shape[0]):
+        results[i] = walk_tree(feat, thr, kind, left, right, leaf, X[i])
+    return results
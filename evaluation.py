@@ -1,4 +1,5 @@
 from typing import List
+import numpy as np
 
 def precision_recall(expected_results: List[bool], actual_results: List[bool]) -> (float, float):
     """Compute the precision and recall of a series of predictions
@@ -18,11 +19,11 @@ def precision_recall(expected_results: List[bool], actual_results: List[bool]) -
         float
             The recall of the predicted results.
     """
-    TP,FP,FN=0,0,0
-    for i in range(len(expected_results)) :
-        TP+=(expected_results[i] and actual_results[i])
-        FP+=(not expected_results[i] and actual_results[i])
-        FN+=(expected_results[i] and not actual_results[i])
+    e = np.asarray(expected_results, dtype=bool)
+    a = np.asarray(actual_results, dtype=bool)
+    TP = int(np.count_nonzero(e & a))
+    FP = int(np.count_nonzero(a)) - TP
+    FN = int(np.count_nonzero(e)) - TP
 
     p = TP / (TP+FP) if TP+FP > 0 else 0.0
     r = TP / (TP+FN) if TP+FN > 0 else 0.0
@@ -32,9 +32,9 @@ def build_tree(file_to_study, tree_size_proportion, is_fudyadt=False, **tree_par
             del_point_feat, del_point_lab = features[i], labels[i]
             current_tree.del_training_point(del_point_feat, del_point_lab)
     else:
-        # Simple decision without dynamic updating
-        for point_features in features[training_nb:]:
-            actual_results.append(current_tree.decide(point_features))
+        # Simple decision without dynamic updating, for the whole test set at once
+        test_features = np.array(features[training_nb:], dtype=np.float64).reshape(-1, len(types))
+        actual_results = current_tree.decide_batch(test_features)
     
     # Print the tree if needed (optional)
     current_tree.print_tree(current_tree)
@@ -49,6 +49,7 @@ if __name__ == '__main__':
     parser.add_argument("-hgt", "--height", type=int, default=5, help="Height (optional, default=5)")
     parser.add_argument("-msp", "--min_split_points", type=int, default=3, help="Min split points (optional, default=3)")
     parser.add_argument("-tsp", "--tree_size_proportion", type=float, default=0.8, help="Tree size proportion (optional, default=0.8)")
+    parser.add_argument("-j", "--n_jobs", type=int, default=1, help="Threads searching the best split (optional, default=1)")
     parser.add_argument("-fudyadt", action="store_true", help="Use the FuDyADT method (optional)")
 
     args = parser.parse_args()
@@ -59,7 +60,8 @@ if __name__ == '__main__':
         tree_size_proportion=args.tree_size_proportion,
         is_fudyadt=args.fudyadt,
         h=args.height,
-        min_split_points=args.min_split_points
+        min_split_points=args.min_split_points,
+        n_jobs=args.n_jobs
     )
     
     print(f"F1 score: {f1_score}")
\ No newline at end of file